@@ -0,0 +1,340 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import networkx as nx
+
+from convergence_ABM import *
+from shared_arrays import *
+
+
+# draw the neighbours selected by the agents src (arrays of any shape)
+def select_neighbours(tables, selection, src, rng):
+    if selection is degree_selection:
+        return tables.draw(src, rng.random(src.shape), rng.random(src.shape), tables.degree_alias_p, tables.degree_alias)
+    if selection is distance_selection:
+        return tables.draw(src, rng.random(src.shape), rng.random(src.shape), tables.distance_alias_p, tables.distance_alias)
+    # random selection: uniform position in the neighbour list
+    pos = (rng.random(src.shape) * tables.degree[src]).astype(np.int64)
+    return tables.indices[tables.indptr[src] + pos]
+
+# check that the rules of a configuration have array versions
+def check_array_config(config_param, name):
+    if config_param.get("selection", random_selection) not in (random_selection, degree_selection, distance_selection):
+        raise ValueError(name + " only supports random, degree and distance selection")
+    # interaction rules with array versions (simple_mean, convergence, dual_convergence, bounded_confidence)
+    if not hasattr(config_param.get("interaction", simple_mean), "batch"):
+        raise ValueError(name + " only supports interactions with pair and batch operators")
+    if config_param.get("next_move", next_expo) is not next_expo:
+        raise ValueError(name + " only supports next_expo")
+    if config_param.get("event_logger"):
+        raise ValueError(name + " does not support event logging")
+
+class ArrayNetworkModel(NetworkModel):
+    """Vectorized gossip engine, drop-in alternative to EventDrivenNetworkModel.
+
+    Node values live in a flat NumPy array and neighbours in CSR arrays. The
+    independent Poisson clocks of the agents (next_expo) are replaced by their
+    superposition: a single clock with rate equal to the sum of the agent rates,
+    where each tick is assigned to an active agent with probability proportional
+    to its rate. Clock ticks, agents and neighbours are pre-drawn in blocks."""
+
+    def __init__(self, config_param):
+        super().__init__(config_param)
+        # only the rules with an array equivalent are supported
+        check_array_config(config_param, type(self).__name__)
+        self.selection = config_param["selection"]
+        self.interaction = config_param["interaction"]
+        # random generator (seeded if requested)
+        self.rng = self.stream.rng
+        # number of events drawn at once
+        self.block_size = config_param.get("block_size", 4096)
+        # check if time logger is needed
+        self.time_logger = config_param["time_logger"]
+        # neighbour lists (built once per graph if passed in, or from a GraphCache)
+        self.neighbour_tables = config_param.get("neighbour_tables") or NeighbourTables(self.G, config_param.get("cache"))
+        # node values
+        self.values = np.array(self.initial_values, dtype=float)
+        # only active agents move, each at rate 1/speed
+        state = np.array([f.state for f in self.features])
+        speed = np.array([f.speed for f in self.features], dtype=float)
+        self.active = np.flatnonzero(state == 1)
+        self.rates = 1 / speed[self.active]
+        self.total_rate = np.sum(self.rates)
+        self.cum_rates = np.cumsum(self.rates)
+        # current time
+        self.now = 0
+
+    def get_time(self):
+        return self.now
+
+    def get_values(self):
+        self.current_values = self.values.tolist()
+        return self.current_values
+
+    # draw n moving agents (proportionally to their rates) and their selected neighbours
+    def draw_pairs(self, n):
+        # homogeneous clocks: uniform choice among active agents
+        if np.all(self.rates == self.rates[0]):
+            src = self.active[self.rng.integers(len(self.active), size=n)]
+        else:
+            u = self.rng.random(n) * self.total_rate
+            src = self.active[np.searchsorted(self.cum_rates, u, side="right")]
+        dst = select_neighbours(self.neighbour_tables, self.selection, src, self.rng)
+        return src, dst
+
+    # draw a block of events: times, moving agents and selected neighbours
+    def draw_events(self, n):
+        times = self.now + np.cumsum(self.rng.exponential(1 / self.total_rate, n))
+        src, dst = self.draw_pairs(n)
+        return times, src, dst
+
+    # apply the interaction sequentially to the (src, dst) pairs
+    def apply_events(self, values, src, dst):
+        if self.interaction is not simple_mean:
+            pair = self.interaction.pair
+            for a, b in zip(src.tolist(), dst.tolist()):
+                old_a, old_b = values[a], values[b]
+                values[a], values[b] = pair(old_a, old_b)
+                if self.error_tracker is not None:
+                    self.error_tracker.update(old_a, old_b, values[a], values[b])
+            return
+        # decrease of the sum of squares: (a - b)^2/2 per interaction
+        drop = 0
+        for a, b in zip(src.tolist(), dst.tolist()):
+            drop += (values[a] - values[b])**2
+            new_value = (values[b] + values[a])/2
+            values[a] = new_value
+            values[b] = new_value
+        # the sum of the values does not change
+        if self.error_tracker is not None:
+            self.error_tracker.s2 -= drop/2
+
+    def log_tick(self, values, t):
+        self.values[:] = values
+        if self.time_logger:
+            self.log_values(t, self.values if isinstance(self.time_log, TimeLog) else self.values.copy())
+        if self.error_tracker is not None:
+            self.error_tracker.sample(t, self.get_values)
+
+    def run_simulation(self):
+        # logging times followed by the end of the simulation
+        end = self.max_horizon if self.adaptive else self.until
+        n_log = int(end/self.log_interval)
+        ticks = np.append(np.arange(n_log) * self.log_interval, end)
+        k = 0
+        # work on a python list in the inner loop, copy back at every log
+        values = self.values.tolist()
+        while k < len(ticks):
+            if self.total_rate == 0:
+                # nobody moves: only log
+                times = np.array([np.inf])
+                src = dst = np.zeros(0, dtype=np.int64)
+            else:
+                times, src, dst = self.draw_events(self.block_size)
+            # events happening before each remaining tick
+            cuts = np.searchsorted(times, ticks[k:], side="left")
+            start = 0
+            for cut in cuts:
+                if cut >= len(times):
+                    break
+                self.apply_events(values, src[start:cut], dst[start:cut])
+                start = cut
+                if k < n_log:
+                    self.log_tick(values, ticks[k])
+                    # adaptive horizon: stop at this tick
+                    if self.adaptive and self.check_convergence():
+                        end = ticks[k]
+                        k = len(ticks)
+                        break
+                k += 1
+            if k < len(ticks):
+                self.apply_events(values, src[start:], dst[start:])
+                self.now = times[-1]
+        self.values[:] = values
+        self.now = end
+        # horizon actually simulated
+        self.metrics["horizon"] = end
+        return self.calculate_error()
+
+class RoundNetworkModel(ArrayNetworkModel):
+    """Round-based approximation of the gossip model, for studies that only need the rate.
+
+    Every round holds `round_size` (moving agent, neighbour) proposals, drawn as
+    in the continuous-time model, and applies those whose two agents are not
+    involved in an earlier proposal of the round. The applied pairs form a
+    matching, so the interaction is applied to all of them at once with its
+    batch operator, exactly as if they happened one after the other. Conflicting
+    proposals are kept, in order, for the next round, so the applied pairs
+    follow the selection rule and only their order changes. Each applied pair
+    counts as one event of the superposed Poisson clock: the time advances by
+    (applied pairs)/(total rate) per round, so rates are comparable with
+    EventDrivenNetworkModel."""
+
+    def __init__(self, config_param):
+        super().__init__(config_param)
+        # proposals per round
+        self.round_size = config_param.get("round_size", max(1, len(self.values)//8))
+        # proposals postponed to the next round
+        self.pending = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    # one round of at most n proposals, returns the number of interactions
+    def apply_round(self, values, n):
+        src, dst = self.pending
+        if len(src) < n:
+            new_src, new_dst = self.draw_pairs(n - len(src))
+            src, dst = np.concatenate([src, new_src]), np.concatenate([dst, new_dst])
+        # apply a proposal only if it is the first one touching both of its agents
+        k = np.arange(len(src))
+        first = np.full(len(values), len(src))
+        np.minimum.at(first, src, k)
+        np.minimum.at(first, dst, k)
+        keep = (first[src] == k) & (first[dst] == k)
+        self.pending = (src[~keep], dst[~keep])
+        a, b = src[keep], dst[keep]
+        old_a, old_b = values[a], values[b]
+        self.interaction.batch(values, a, b)
+        if self.error_tracker is not None:
+            self.error_tracker.update_batch(old_a, old_b, values[a], values[b])
+        return len(a)
+
+    # run rounds up to time t
+    def advance(self, values, t):
+        if self.total_rate == 0:
+            self.now = max(self.now, t)
+        while self.now < t:
+            # last rounds: no more proposals than the events left before t
+            n = min(self.round_size, max(1, int(np.ceil((t - self.now) * self.total_rate))))
+            self.now += self.apply_round(values, n) / self.total_rate
+
+    def run_simulation(self):
+        end = self.max_horizon if self.adaptive else self.until
+        n_log = int(end/self.log_interval)
+        values = self.values
+        for k in range(n_log):
+            tick = k * self.log_interval
+            self.advance(values, tick)
+            self.log_tick(values, tick)
+            # adaptive horizon: stop at this tick
+            if self.adaptive and self.check_convergence():
+                end = tick
+                break
+        else:
+            self.advance(values, end)
+        self.now = end
+        # horizon actually simulated
+        self.metrics["horizon"] = end
+        return self.calculate_error()
+
+def run_replicates(config_param, initial_values=None, reps=None):
+    """Run R replicates of the same graph together as a (R x N) state array.
+
+    Initial values are either given as a (R x N) matrix or generated as `reps`
+    random permutations of the values in config_param["features"]. States and
+    speeds are taken from the features and shared by all replicates. Within
+    each logging interval every replicate draws its number of events from the
+    superposed Poisson clock; replicates with fewer events are padded with
+    self-interactions, which leave the values unchanged. Neighbours are chosen
+    with config_param["selection"] (random, degree or distance selection) and
+    interact with the batch operator of config_param["interaction"] (default
+    simple_mean). Returns the (R x T) Boyd error curves and the R contraction rates."""
+    check_array_config(config_param, "run_replicates")
+    G = config_param["graph"]
+    features = config_param["features"]
+    until = config_param["max_time"]
+    interval = config_param["log_interval"]
+    rng = np.random.default_rng(config_param.get("seed"))
+    batch = config_param.get("interaction", simple_mean).batch
+    N = G.number_of_nodes()
+    # initial values
+    if initial_values is None:
+        base = np.array([f.value for f in features], dtype=float)
+        initial_values = np.array([rng.permutation(base) for _ in range(reps)])
+    X = np.array(initial_values, dtype=float)
+    R = X.shape[0]
+    V0_norm = np.sum(X**2, axis=1)**0.5
+    # shared structures, built once for all replicates
+    tables = config_param.get("neighbour_tables") or NeighbourTables(G, config_param.get("cache"))
+    state = np.array([f.state for f in features])
+    speed = np.array([f.speed for f in features], dtype=float)
+    active = np.flatnonzero(state == 1)
+    rates = 1 / speed[active]
+    total_rate = np.sum(rates)
+    cum_rates = np.cumsum(rates)
+    # flat view of the state: replicate r, node i -> r*N + i
+    Xf = X.reshape(-1)
+    offset = np.arange(R)[None, :] * N
+    n_log = int(until/interval)
+    err = np.empty((R, n_log))
+    for t in range(n_log):
+        # error at the logging tick
+        err[:, t] = np.sum((X - X.mean(axis=1, keepdims=True))**2, axis=1)**0.5 / V0_norm
+        if total_rate == 0:
+            continue
+        # number of events of each replicate in the interval
+        counts = rng.poisson(total_rate * interval, R)
+        K = counts.max()
+        # moving agents and selected neighbours (K steps x R replicates)
+        u = rng.random((K, R)) * total_rate
+        src = active[np.searchsorted(cum_rates, u, side="right")]
+        dst = select_neighbours(tables, config_param.get("selection", random_selection), src, rng)
+        # pad replicates that have already run out of events
+        idle = np.arange(K)[:, None] >= counts[None, :]
+        dst[idle] = src[idle]
+        ia = src + offset
+        ib = dst + offset
+        # pairs of a step belong to different replicates
+        for k in range(K):
+            batch(Xf, ia[k], ib[k])
+    # contraction rate in the second half of the simulation
+    x = np.linspace(0, until - interval, n_log)
+    return err, contraction_rate(x, err.T)
+
+# neighbour tables built in this worker, by shared graph
+worker_tables = {}
+
+def run_replicate_task(task):
+    """Run a chunk of replicates on arrays published by run_replicates_parallel (in a worker)."""
+    graph, values, state, speed, rows, config, seed = task
+    G = attach_graph(graph)
+    # tables built once per graph in every worker
+    key = graph["indices"][0]
+    if key not in worker_tables:
+        worker_tables[key] = NeighbourTables(G)
+    config_param = dict(config, graph=G, seed=seed, neighbour_tables=worker_tables[key],
+                        features=[AgentFeatures(0, s, v) for s, v in zip(attach(state).tolist(), attach(speed).tolist())])
+    return run_replicates(config_param, attach(values)[rows[0]:rows[1]])
+
+def run_replicates_parallel(config_param, initial_values=None, reps=None, workers=None, chunk=16):
+    """run_replicates split over a process pool, with the graph and the values in shared memory.
+
+    The CSR arrays of the graph, the states, the speeds and the (R x N) initial
+    values are published once; every task only carries their handles and its
+    rows of the initial values (`chunk` replicates per task). Every chunk has
+    its own seed, spawned from config_param["seed"] by chunk index, so the
+    results depend on the seed and on `chunk` but not on the number of workers.
+    The shared blocks are released when the run ends or fails. Returns the (R x T) Boyd error curves and the R contraction rates,
+    in the order of the initial values."""
+    seed = config_param.get("seed")
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    features = config_param["features"]
+    # initial values
+    if initial_values is None:
+        rng = np.random.default_rng(seed)
+        base = np.array([f.value for f in features], dtype=float)
+        initial_values = np.array([rng.permutation(base) for _ in range(reps)])
+    X = np.array(initial_values, dtype=float)
+    R = X.shape[0]
+    starts = range(0, R, chunk)
+    seeds = seed.spawn(len(starts))
+    # everything but the graph and the features goes in the task messages
+    config = {k: v for k, v in config_param.items() if k not in ("graph", "features", "neighbour_tables", "seed")}
+    with SharedArrays() as shared:
+        graph = shared.publish_graph(config_param["graph"])
+        values = shared.publish(X)
+        state = shared.publish(np.array([f.state for f in features]))
+        speed = shared.publish(np.array([f.speed for f in features], dtype=float))
+        tasks = [(graph, values, state, speed, (s, min(s + chunk, R)), config, seeds[i]) for i, s in enumerate(starts)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            results = list(pool.map(run_replicate_task, tasks))
+    return np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results])
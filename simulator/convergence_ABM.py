@@ -6,6 +6,11 @@ import time, enum, math
 import pandas as pd
 
 from graph_metrics import *
+from graph_cache import *
+from neighbour_tables import *
+from random_streams import *
+from event_queue import *
+from event_log import *
 from interaction_methods import *
 
 
@@ -43,12 +48,20 @@ class Agent():
         self.last_move = 0
         # event_logger
         self.event_logger = event_logger
-        # get neighbours indices (only once in static networks)
-        self.neighbours = self.get_neighbours()
-        # get neighbours degree
-        self.degree_p = self.get_degrees()
-        # get neighbours distance
-        self.distance_p = self.get_distances()
+        # get neighbours indices, degree and distance (only once in static networks)
+        if model.neighbour_tables is not None:
+            # slices of the tables shared by all agents
+            self.neighbours, self.degree_p, self.distance_p = model.neighbour_tables.get(unique_id, model.neighbour_order)
+            # alias tables for O(1) weighted selection
+            tables = model.neighbour_tables
+            self.degree_alias = tables.get_alias(unique_id, tables.degree_alias_p, tables.degree_alias)
+            self.distance_alias = tables.get_alias(unique_id, tables.distance_alias_p, tables.distance_alias)
+        else:
+            self.neighbours = self.get_neighbours()
+            self.degree_p = self.get_degrees()
+            self.distance_p = self.get_distances()
+            self.degree_alias = None
+            self.distance_alias = None
     
     # get neighbouring nodes
     def get_neighbours(self):
@@ -67,7 +80,8 @@ class Agent():
         return [d/sum(degrees) for d in degrees]
 
     def get_distances(self):
-        dist = [1/(len(list(nx.common_neighbors(self.model.G, self.unique_id, n))) + 1) for n in self.neighbours]
+        own = set(self.model.G.neighbors(self.unique_id))
+        dist = [1/(len(own.intersection(self.model.G.neighbors(n))) + 1) for n in self.neighbours]
         return [d/sum(dist) for d in dist]
 
     def update_neighbours(self):
@@ -75,12 +89,9 @@ class Agent():
         self.degree_p = self.get_degrees()
         self.distance_p = self.get_distances()
 
-    # add statistics to dictionary
+    # add statistics to the event log
     def log_event(self, neigh):
-        # generate unique name for the dictionary entry
-        key_name = "Agent" + str(self.unique_id) + "_" + str(self.move_count)
-        # add entry to model
-        self.model.event_log[key_name] = [self.model.get_time(), self.unique_id, neigh.unique_id, self.value]
+        self.model.event_log.append(self.model.get_time(), self.unique_id, neigh.unique_id, self.value)
 
     # make a move
     def play(self):  
@@ -88,12 +99,17 @@ class Agent():
         # self.neighbours = self.update_neighbours()     
         # select neighbours
         neigh_id = self.select_neighbour()
-        neigh = self.model.G.nodes[neigh_id]['agent']
+        neigh = self.model.agents[neigh_id]
         # if not active, activate neighbour -- not necessary for static networks
         # if neigh.state == 0:
         #    neigh.activate()
+        # values before the interaction
+        old_values = self.value, neigh.value
         # interact
         self, neigh = self.interact(neigh)
+        # update running error
+        if self.model.error_tracker is not None:
+            self.model.error_tracker.update(*old_values, self.value, neigh.value)
         # add move
         self.move_count += 1
         # log only if needed
@@ -138,13 +154,145 @@ class EventDrivenAgent(Agent):
         # activate
         self.condition_flag.succeed()
 
+class ScheduledAgent(Agent):
+    """Agent moved by an EventQueue (or PoissonClock) instead of a SimPy process."""
+    def __init__(self, unique_id, model, value, select_neighbour, interact, next_move_time, event_logger):
+        super().__init__(unique_id, model, value, select_neighbour, interact, next_move_time, event_logger)
+        # set scheduler
+        self.env = model.env
+        # moves already scheduled
+        self.started = False
+        if self.state == 1:
+            self.start()
+
+    def start(self):
+        self.started = True
+        self.env.add(self)
+
+    # make a move and plan the next one
+    def step(self):
+        self.play()
+        self.next_move = self.next_move_time(self.speed)
+        self.env.schedule(self.next_move, self.step)
+
+    def activate(self):
+        self.state = 1
+        # update last move time
+        self.last_move = self.model.get_time()
+        # first move after next_move from now, as with the SimPy condition flag
+        if not self.started:
+            self.start()
+
+
+# contraction rate: slope of the log error from time start (default: second half of the samples)
+def contraction_rate(x, err, start=None):
+    x, err = np.asarray(x), np.asarray(err)
+    h = int(len(x)/2) if start is None else np.searchsorted(x, start)
+    m, c = np.polyfit(x[h:], np.log(err[h:]), 1)
+    return np.abs(m)
+
+class TimeLog():
+    """Preallocated storage of the values logged at intervals.
+
+    Rows are filled in place in a (T x N) array. With `tail` set, only the last
+    `tail` rows are kept in a ring buffer; every row is written twice (at i and
+    i + tail) so that the retained rows are always a contiguous view."""
+    def __init__(self, n_rows, n_nodes, dtype=np.float64, tail=None):
+        self.tail = tail
+        size = n_rows if tail is None else 2*tail
+        self.times = np.empty(size)
+        self.values = np.empty((size, n_nodes), dtype=dtype)
+        # number of rows written
+        self.count = 0
+
+    def append(self, t, values):
+        if self.tail is None:
+            # more rows than planned (e.g. rounding of the logging times)
+            if self.count == len(self.times):
+                self.times = np.concatenate([self.times, np.empty_like(self.times)])
+                self.values = np.concatenate([self.values, np.empty_like(self.values)])
+            rows = [self.count]
+        else:
+            i = self.count % self.tail
+            rows = [i, i + self.tail]
+        for r in rows:
+            self.times[r] = t
+            self.values[r] = values
+        self.count += 1
+
+    # first row of the retained window
+    def start(self):
+        if self.tail is None or self.count <= self.tail:
+            return 0
+        return self.count % self.tail
+
+    def length(self):
+        return self.count if self.tail is None else min(self.count, self.tail)
+
+    # views of the retained rows (no copy)
+    def get_times(self):
+        return self.times[self.start():self.start() + self.length()]
+
+    def get_values(self):
+        return self.values[self.start():self.start() + self.length()]
+
+class ErrorTracker():
+    """Running Boyd error, updated in O(1) at every interaction.
+
+    Keeps the sums of the values and of their squares, both shifted by the mean
+    at the last exact computation so that the variance is not lost to
+    cancellation. When the error has dropped by more than `refresh` since then,
+    the sums are recomputed exactly from the current values."""
+    def __init__(self, initial_values, refresh=1e-2):
+        self.n = len(initial_values)
+        # normalisation of error_boyd
+        self.norm0 = np.sum(np.array(initial_values)**2)**0.5
+        self.refresh = refresh
+        # sampled errors
+        self.times = []
+        self.errors = []
+        self.reset(initial_values)
+
+    # exact sums from the current values
+    def reset(self, values):
+        values = np.array(values, dtype=float)
+        self.shift = np.mean(values)
+        self.s1 = np.sum(values - self.shift)
+        self.s2 = np.sum((values - self.shift)**2)
+        self.s2_ref = self.s2
+
+    # two values changed in an interaction
+    def update(self, old_a, old_b, new_a, new_b):
+        old_a, old_b = old_a - self.shift, old_b - self.shift
+        new_a, new_b = new_a - self.shift, new_b - self.shift
+        self.s1 += new_a + new_b - old_a - old_b
+        self.s2 += new_a*new_a + new_b*new_b - old_a*old_a - old_b*old_b
+
+    # arrays of disjoint pairs changed at once
+    def update_batch(self, old_a, old_b, new_a, new_b):
+        old = np.concatenate([old_a, old_b]) - self.shift
+        new = np.concatenate([new_a, new_b]) - self.shift
+        self.s1 += np.sum(new) - np.sum(old)
+        self.s2 += np.sum(new*new) - np.sum(old*old)
+
+    def error(self):
+        return max(self.s2 - self.s1**2/self.n, 0)**0.5/self.norm0
+
+    # record the error at time t (get_values is only called to refresh the sums)
+    def sample(self, t, get_values):
+        if self.s2 < self.refresh*self.s2_ref:
+            self.reset(get_values())
+        self.times.append(t)
+        self.errors.append(self.error())
 
 class NetworkModel():
     """Base class for a network model"""
 
     def __init__(self, config_param):
-        # get graph
-        self.G = config_param["graph"]   
+        # get graph (read only, as CSR neighbour lists)
+        self.G = as_csr(config_param["graph"])
+        # agents, indexed by node
+        self.agents = []
         # add features
         self.features = config_param["features"]
         # get initial values
@@ -159,25 +307,75 @@ class NetworkModel():
         self.stats_net = {}
         # calculate node properties
         self.stats_node = {}
-        # record data at intervals 
-        self.event_log = {}
-        # record events
-        self.time_log = {}
+        # record all events if requested (spilled to disk if a path is given)
+        self.event_log = EventLog(spill=config_param.get("event_log_path")) if config_param.get("event_logger") else None
+        # record events (preallocated array if requested)
+        if config_param.get("log_buffer") or config_param.get("log_tail"):
+            self.time_log = TimeLog(int(round(self.until/self.log_interval)), len(self.features),
+                config_param.get("log_dtype", np.float64), config_param.get("log_tail"))
+        else:
+            self.time_log = {}
         # convergence metrics
         self.metrics = {}
+        # shared neighbour tables (None: every agent builds its own lists)
+        self.neighbour_tables = None
+        # random numbers for the agents (seeded per replicate if requested)
+        self.stream = RandomStream(config_param.get("seed"))
+        # running error (instead of computing it from the time log)
+        self.error_tracker = ErrorTracker(self.initial_values) if config_param.get("error_tracker") or config_param.get("adaptive") else None
+        # adaptive horizon: stop when the rate is stable (after min_horizon) or the error reaches the floor
+        self.adaptive = config_param.get("adaptive", False)
+        self.rate_tol = config_param.get("rate_tol", 1e-2)
+        self.error_floor = config_param.get("error_floor", 1e-10)
+        self.patience = config_param.get("patience", 5)
+        # shortest horizon of an adaptive run before a rate-based stop
+        self.min_horizon = config_param.get("min_horizon", self.until)
+        # consecutive checks where the early and late rates agree
+        self.agreements = 0
+        # longest horizon of an adaptive run (it can go beyond max_time for slow graphs);
+        # metrics["horizon"] is the time of the last error sample when an adaptive run stops early
+        self.max_horizon = config_param.get("max_horizon", self.until)
+        # rate estimates during an adaptive run
+        self.rate_estimates = []
 
     # calculate graph and node properties
-    def get_graph_properties(self):
-        # calculate graph metrics
-        self.stats_net, self.stats_node = graph_metrics(self.G)
+    def get_graph_properties(self, cache=None):
+        # calculate graph metrics (or load them from a GraphCache)
+        if cache is not None:
+            self.stats_net, self.stats_node = cache.get_or_compute(graph_hash(self.G), "metrics", lambda: graph_metrics(self.G))
+        else:
+            self.stats_net, self.stats_node = graph_metrics(self.G)
         return self.stats_net, self.stats_node
 
     def get_nodes(self):
-        return [self.G.nodes[_]['agent'] for _ in self.G.nodes]
+        return self.agents
 
     def run_simulation(self):
         pass
 
+    # check if an adaptive run can stop (called at every logging tick)
+    def check_convergence(self):
+        times, errors = self.error_tracker.times, self.error_tracker.errors
+        # error reached the floor
+        if errors[-1] < self.error_floor:
+            return True
+        # no rate-based stop before the minimum horizon
+        t = times[-1]
+        if t < self.min_horizon:
+            return False
+        # rates fitted on the disjoint windows [t/4, t/2] and [t/2, t] (spanning a factor 4
+        # in time, so that the slow drift of the rate during the transient is seen)
+        x, err = np.asarray(times), np.asarray(errors)
+        a, b = np.searchsorted(x, t/4), np.searchsorted(x, t/2)
+        if b - a < 2 or len(x) - b < 2:
+            return False
+        early = contraction_rate(x[a:b], err[a:b], x[a])
+        late = contraction_rate(x[b:], err[b:], x[b])
+        self.rate_estimates.append(late)
+        # the windows agree within the tolerance at `patience` consecutive checks
+        self.agreements = self.agreements + 1 if abs(early - late) <= self.rate_tol*(early + late)/2 else 0
+        return self.agreements >= self.patience
+
     def get_time(self):
         pass
 
@@ -186,31 +384,56 @@ class NetworkModel():
         self.current_values = [n.value for n in self.get_nodes()]
         return self.current_values
 
+    # store values in the time log
+    def log_values(self, t, values):
+        if isinstance(self.time_log, TimeLog):
+            self.time_log.append(t, values)
+        else:
+            self.time_log[t] = values
+
     # method to retrieve time logs as pandas dataframe
     def get_event_log(self):
-        df = pd.DataFrame(self.event_log, index = ["Time","AgentID1","AgentID2","Value"]).T
-        df = df.astype({"AgentID_A": 'int32', "AgentID_B": 'int32'})
-        return df
+        if self.event_log is None:
+            # no events recorded: empty frame with the same columns
+            return EventLog().to_frame()
+        return self.event_log.to_frame()
 
     # method to retrieve event logs as pandas dataframe
     def get_time_log(self):   
-        df = pd.DataFrame(self.time_log, index = ["Agent_"+ str(i) for i in range(self.G.number_of_nodes())]).T
+        columns = ["Agent_"+ str(i) for i in range(self.G.number_of_nodes())]
+        if isinstance(self.time_log, TimeLog):
+            # wrap the logged rows without copying
+            return pd.DataFrame(self.time_log.get_values(), index = self.time_log.get_times(), columns = columns, copy = False)
+        df = pd.DataFrame(self.time_log, index = columns).T
         return df
 
     # calculating global error
     def calculate_error(self):
+        # error samples collected during the simulation
+        if self.error_tracker is not None:
+            err = pd.Series(self.error_tracker.errors, index = self.error_tracker.times)
+            return err, contraction_rate(err.index.values, err.values)
+        # generate time points for regression
+        x = np.linspace(0, self.until - self.log_interval, int(self.until/self.log_interval))
+        if isinstance(self.time_log, TimeLog):
+            # Boyd error of all logged rows at once
+            values = self.time_log.get_values()
+            err = np.sum((values - values.mean(axis = 1, keepdims = True))**2, axis = 1)**0.5
+            err = pd.Series(err/np.sum(np.array(self.initial_values)**2)**0.5, index = self.time_log.get_times())
+            # fit on the second half of the simulation (or on the retained tail)
+            return err, contraction_rate(err.index.values, err.values, x[int(len(x)/2)])
         # get time log if not previously calculates
         df = self.get_time_log()
         # calculate Boyd error
         err = df.apply(lambda x: error_boyd(x, self.initial_values), axis = 1)
-        # generate time points for regression
-        x = np.linspace(0, self.until - self.log_interval, int(self.until/self.log_interval))
-        # calculate contraction rate in the second half of the simulation
-        m, c = np.polyfit(x[int(len(x)/2):], np.log(err[int(len(x)/2):]), 1)
-        return err, np.abs(m)
+        return err, contraction_rate(x, err)
 
     # calculating individual error
     def calculate_indiv_error(self):
+        if isinstance(self.time_log, TimeLog):
+            values = self.time_log.get_values()
+            error_indiv = np.sum((values - values.mean(axis = 0))**2, axis = 0)**0.5/np.abs(values[0])
+            return pd.Series(error_indiv, index = self.get_time_log().columns)
         # get time log if not previously calculates
         df = self.get_time_log()
         # calculate Boyd error
@@ -245,24 +468,55 @@ class EventDrivenNetworkModel(NetworkModel):
     def __init__(self, config_param):
         super().__init__(config_param) 
         # Set-up environment and graph
-        self.env = Environment() #simpy.Environment()  
+        scheduler = config_param.get("scheduler")
+        if scheduler:
+            # lightweight scheduler: superposed clock if all the agents move at the same Poisson rate
+            homogeneous = config_param["next_move"] is next_expo and len(set(f.speed for f in self.features)) == 1
+            if scheduler == "clock" and not homogeneous:
+                raise ValueError("the clock scheduler needs next_expo and identical speeds")
+            if scheduler == "clock" or (scheduler != "heap" and homogeneous):
+                self.env = PoissonClock(self.stream, self.features[0].speed)
+            else:
+                self.env = EventQueue()
+            agent_class, logger_class = ScheduledAgent, ScheduledLogger
+        else:
+            self.env = Environment() #simpy.Environment()  
+            agent_class, logger_class = EventDrivenAgent, EventDrivenLogger
+        # neighbour lists and selection probabilities (built once per graph if passed in)
+        self.neighbour_tables = config_param.get("neighbour_tables") or NeighbourTables(self.G, config_param.get("cache"))
+        # shuffle neighbour lists to reduce chance of syncronization
+        self.neighbour_order = self.neighbour_tables.shuffle(self.stream.rng)
 
         # Create agents
         for i in self.G.nodes():    
             # create all agents
-            a = EventDrivenAgent(i, self, self.features[i], config_param["selection"], config_param["interaction"], 
+            a = agent_class(i, self, self.features[i], config_param["selection"], config_param["interaction"], 
                 config_param["next_move"], config_param["event_logger"])
             # assign agent
-            self.G.nodes[i]['agent'] = a
+            self.agents.append(a)
 
         # check if time logger is needed    
-        if config_param["time_logger"]:
+        self.time_logger = config_param["time_logger"]
+        if self.time_logger or self.error_tracker is not None:
             # Create logger
-            self.logger = EventDrivenLogger(self, config_param["log_interval"])
+            self.logger = logger_class(self, config_param["log_interval"])
 
     def run_simulation(self):
         # Run trial
-        self.env.run(until=self.until)
+        if self.adaptive:
+            # advance one logging interval at a time
+            t = 0
+            while t < self.max_horizon:
+                t = min(t + self.log_interval, self.max_horizon)
+                self.env.run(until=t)
+                if self.check_convergence():
+                    # stopped at the last error sample, as in the array engines
+                    self.metrics["horizon"] = self.error_tracker.times[-1]
+                    return self.calculate_error()
+        else:
+            self.env.run(until=self.until)
+        # horizon actually simulated
+        self.metrics["horizon"] = self.env.now
         return self.calculate_error()  
 
     def get_time(self):
@@ -275,6 +529,14 @@ class Logger():
         # get model
         self.model = model
 
+    def log(self, t):
+        # get data in nodes and save in dictionary
+        if self.model.time_logger:
+            self.model.log_values(t, self.model.get_values())
+        # sample running error
+        if self.model.error_tracker is not None:
+            self.model.error_tracker.sample(t, self.model.get_values)
+
 class EventDrivenLogger(Logger):
     def __init__(self, model, logging_interval):
         super().__init__(model, logging_interval) 
@@ -285,35 +547,18 @@ class EventDrivenLogger(Logger):
 
     def run(self):
         while True:
-            # get data in nodes and save in dictionary
-            self.model.time_log[self.env.now] = self.model.get_values()
+            self.log(self.env.now)
             # pause
             yield self.env.timeout(self.interval)
 
-"""
-# run 100 times and store results
-def run_batch_complete(index):
-    # update parameters
-    config_param_c["features"] = [AgentFeatures(values1[i], states[i], speeds[i]) for i in range(N)]
-    # generate model
-    sim_complete = EventDrivenNetworkModel(config_param_c)
-    # evolve model
-    sim_complete.run_simulation()
-    # get results
-    df = sim_complete.get_time_log()
-    # run name
-    name = "Run_" + str(index)
-    # save metrics
-    complete_500[name] = df.apply(lambda x: group_div(x), axis = 1)
-    # inform user
-    print(str(index) + " done")
-    return complete_500
-
-
-if __name__ == '__main__':
-
-    pool = Pool(processes = 20)
-
-    pool.map(run_batch_complete, index)
-
-"""
+class ScheduledLogger(Logger):
+    def __init__(self, model, logging_interval):
+        super().__init__(model, logging_interval)
+        # set scheduler
+        self.env = self.model.env
+        # first log at time 0
+        self.env.schedule(0, self.run)
+
+    def run(self):
+        self.log(self.env.now)
+        self.env.schedule(self.interval, self.run)
@@ -0,0 +1,101 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sps
+
+
+class CSRGraph():
+    """Immutable undirected graph on the nodes 0..N-1, stored as CSR neighbour lists.
+
+    The neighbours of node i are indices[indptr[i]:indptr[i+1]] (int32, sorted).
+    Node positions (the "pos" attribute of geometric graphs) are kept as an
+    (N x 2) array. Provides the part of the networkx interface used by the
+    simulator (number_of_nodes, nodes, neighbors, degree, edges). Conversion
+    to and from networkx keeps the nodes, the edges and the positions; the
+    graph is unweighted, so edge weights and other attributes are dropped."""
+    def __init__(self, indptr, indices, pos=None):
+        self.indptr = np.asarray(indptr, dtype=np.int32)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.pos = None if pos is None else np.asarray(pos, dtype=float)
+        self.degree = np.diff(self.indptr)
+        # read only
+        for a in (self.indptr, self.indices, self.degree, self.pos):
+            if a is not None:
+                a.flags.writeable = False
+        self.networkx = None
+
+    # graph from an (M x 2) array of undirected edges
+    @classmethod
+    def from_edges(cls, N, edges, pos=None):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        A = sps.coo_matrix((np.ones(2*len(edges), dtype=np.int8),
+                            (np.concatenate([edges[:, 0], edges[:, 1]]), np.concatenate([edges[:, 1], edges[:, 0]]))),
+                           shape=(N, N)).tocsr()
+        # merge duplicate edges
+        A.sum_duplicates()
+        A.sort_indices()
+        return cls(A.indptr, A.indices, pos)
+
+    @classmethod
+    def from_networkx(cls, G):
+        N = G.number_of_nodes()
+        if set(G.nodes()) != set(range(N)):
+            raise ValueError("CSRGraph needs the nodes 0..N-1")
+        pos = nx.get_node_attributes(G, "pos")
+        pos = np.array([pos[i] for i in range(N)]) if len(pos) == N else None
+        return cls.from_edges(N, np.array(list(G.edges()), dtype=np.int64), pos)
+
+    def to_networkx(self):
+        G = nx.empty_graph(self.number_of_nodes())
+        G.add_edges_from(self.edges().tolist())
+        if self.pos is not None:
+            nx.set_node_attributes(G, dict(enumerate(self.pos.tolist())), "pos")
+        return G
+
+    def number_of_nodes(self):
+        return len(self.degree)
+
+    def number_of_edges(self):
+        return len(self.indices)//2
+
+    def nodes(self):
+        return range(self.number_of_nodes())
+
+    def neighbors(self, i):
+        return iter(self.indices[self.indptr[i]:self.indptr[i+1]].tolist())
+
+    # (M x 2) array of the edges (i, j) with i < j
+    def edges(self):
+        row = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int32), self.degree)
+        keep = row < self.indices
+        return np.column_stack([row[keep], self.indices[keep]])
+
+    # sparse adjacency matrix
+    def adjacency(self, dtype=float):
+        return sps.csr_matrix((np.ones(len(self.indices), dtype=dtype), self.indices, self.indptr),
+                              shape=(self.number_of_nodes(), self.number_of_nodes()))
+
+    # do not pickle the networkx copy
+    def __getstate__(self):
+        return {"indptr": self.indptr, "indices": self.indices, "pos": self.pos}
+
+    def __setstate__(self, state):
+        self.__init__(state["indptr"], state["indices"], state["pos"])
+
+# graph as a CSRGraph (no copy if it already is one)
+def as_csr(G):
+    return G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+
+# graph as a networkx graph (converted once per CSRGraph)
+def as_networkx(G):
+    if not isinstance(G, CSRGraph):
+        return G
+    if G.networkx is None:
+        G.networkx = G.to_networkx()
+    return G.networkx
+
+# sparse 0/1 adjacency matrix of a networkx graph or a CSRGraph
+def adjacency(G):
+    if isinstance(G, CSRGraph):
+        return G.adjacency()
+    # unweighted, like CSRGraph (edge weights are ignored)
+    return nx.to_scipy_sparse_array(G, format="csr", dtype=float, weight=None)
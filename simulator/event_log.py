@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class EventLog():
+    """Columnar log of the interactions, stored in growable typed arrays.
+
+    Every event is a row (time, agent, selected neighbour, value of the agent
+    after the interaction). Columns are preallocated and doubled when full.
+    With `spill` set to a path prefix, the rows are written to one binary file
+    per column (spill + ".time", ...) every `buffer_rows` events, so memory
+    stays bounded; the columns are then read back as memory maps. The spill
+    files must not exist yet (FileExistsError otherwise); close() removes them."""
+    columns = {"Time": np.float64, "AgentID_A": np.int32, "AgentID_B": np.int32, "Value": np.float64}
+
+    def __init__(self, capacity=1024, spill=None, buffer_rows=2**16):
+        self.spill = spill
+        self.capacity = buffer_rows if spill is not None else capacity
+        self.data = {c: np.empty(self.capacity, dtype=d) for c, d in self.columns.items()}
+        # rows in memory and rows already written to disk
+        self.count = 0
+        self.spilled = 0
+        if spill is not None:
+            # new empty files (an existing prefix may still be memory mapped by another log)
+            existing = [self.file(c) for c in self.columns if os.path.exists(self.file(c))]
+            if existing:
+                raise FileExistsError("event log spill files already exist: " + ", ".join(existing))
+            for c in self.columns:
+                open(self.file(c), "xb").close()
+
+    def __len__(self):
+        return self.spilled + self.count
+
+    def file(self, column):
+        return self.spill + "." + column.lower()
+
+    def append(self, t, src, dst, value):
+        if self.count == self.capacity:
+            if self.spill is not None:
+                self.flush()
+            else:
+                self.capacity *= 2
+                for c in self.columns:
+                    self.data[c] = np.resize(self.data[c], self.capacity)
+        i = self.count
+        data = self.data
+        data["Time"][i] = t
+        data["AgentID_A"][i] = src
+        data["AgentID_B"][i] = dst
+        data["Value"][i] = value
+        self.count += 1
+
+    # write the rows in memory to the spill files
+    def flush(self):
+        for c in self.columns:
+            with open(self.file(c), "ab") as f:
+                self.data[c][:self.count].tofile(f)
+        self.spilled += self.count
+        self.count = 0
+
+    # dictionary of column arrays (views of the buffers or memory maps of the spill files)
+    def get_columns(self):
+        if self.spill is None:
+            return {c: self.data[c][:self.count] for c in self.columns}
+        self.flush()
+        if self.spilled == 0:
+            return {c: np.empty(0, dtype=d) for c, d in self.columns.items()}
+        return {c: np.memmap(self.file(c), dtype=d, mode="r") for c, d in self.columns.items()}
+
+    def to_frame(self):
+        return pd.DataFrame(self.get_columns(), copy=False)
+
+    def to_arrow(self):
+        import pyarrow as pa
+        return pa.table(self.get_columns())
+
+    # remove the spill files
+    def close(self):
+        if self.spill is not None:
+            for c in self.columns:
+                if os.path.exists(self.file(c)):
+                    os.remove(self.file(c))
@@ -0,0 +1,65 @@
+import heapq, math
+
+
+class EventQueue():
+    """Minimal replacement of the SimPy environment: a single heap of callbacks.
+
+    Events are (time, order, callback) tuples, so events at the same time run in
+    the order they were scheduled, as in SimPy. run(until) processes the events
+    before `until` and leaves the clock at `until`."""
+    def __init__(self):
+        self.now = 0
+        self.queue = []
+        self.count = 0
+
+    def schedule(self, delay, callback):
+        heapq.heappush(self.queue, (self.now + delay, self.count, callback))
+        self.count += 1
+
+    # start the moves of an active agent
+    def add(self, agent):
+        self.schedule(agent.next_move, agent.step)
+
+    def run(self, until):
+        queue = self.queue
+        while queue and queue[0][0] < until:
+            self.now, _, callback = heapq.heappop(queue)
+            callback()
+        self.now = until
+
+class PoissonClock(EventQueue):
+    """Superposed clock of agents with identical exponential waiting times.
+
+    With n active agents of mean waiting time `speed`, the next move happens
+    after an exponential time of mean speed/n and is made by an active agent
+    chosen uniformly. Agent moves are not stored in the heap, which only holds
+    the other events (logging). As the clocks are memoryless, the next tick is
+    simply redrawn when an agent is activated."""
+    def __init__(self, stream, speed):
+        super().__init__()
+        self.stream = stream
+        self.speed = speed
+        self.agents = []
+        self.next_tick = math.inf
+
+    def add(self, agent):
+        self.agents.append(agent)
+        self.next_tick = self.now + self.stream.exponential(self.speed/len(self.agents))
+
+    def run(self, until):
+        queue, agents, stream = self.queue, self.agents, self.stream
+        while True:
+            t = queue[0][0] if queue else math.inf
+            if self.next_tick <= t:
+                if self.next_tick >= until:
+                    break
+                # move of a random active agent
+                self.now = self.next_tick
+                agents[stream.index(len(agents))].play()
+                self.next_tick = self.now + stream.exponential(self.speed/len(agents))
+            else:
+                if t >= until:
+                    break
+                self.now, _, callback = heapq.heappop(queue)
+                callback()
+        self.now = until
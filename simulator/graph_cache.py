@@ -0,0 +1,141 @@
+import hashlib, json, os, pickle
+
+import numpy as np
+import networkx as nx
+import scipy.sparse as sps
+
+from graph_metrics import *
+
+
+# canonical hash of a graph (edge list, number of nodes, generator parameters and seed)
+def graph_hash(G, params=None, seed=None):
+    edges = np.array(G.edges() if isinstance(G, CSRGraph) else list(G.edges()), dtype=np.int64).reshape(-1, 2)
+    edges.sort(axis=1)
+    edges = edges[np.lexsort((edges[:, 1], edges[:, 0]))]
+    h = hashlib.sha256()
+    h.update(str(G.number_of_nodes()).encode())
+    h.update(edges.tobytes())
+    h.update(json.dumps([params, seed], sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+def neighbour_arrays(G):
+    """CSR neighbour lists with the degree and distance selection probabilities.
+
+    For the edge i-j stored at position e of row i, degree_p[e] is proportional
+    to the degree of j and distance_p[e] to 1/(common neighbours of i and j + 1),
+    both normalised over the row (as Agent.get_degrees and Agent.get_distances)."""
+    A = as_csr(G).adjacency()
+    indptr, indices = A.indptr.astype(np.int64), A.indices.astype(np.int64)
+    deg = np.diff(indptr)
+    row = np.repeat(np.arange(len(deg)), deg)
+    # common neighbours + 1 on the edges (same sparsity pattern as A)
+    common = sps.csr_matrix(A.multiply(A @ A) + A)
+    common.sort_indices()
+    degree_w = deg[indices].astype(float)
+    distance_w = 1/common.data
+    # normalise over each row
+    row_sum = lambda w: np.bincount(row, weights=w, minlength=len(deg))[row]
+    return {"indptr": indptr, "indices": indices,
+            "degree_p": degree_w/row_sum(degree_w),
+            "distance_p": distance_w/row_sum(distance_w)}
+
+class GraphCache():
+    """On-disk cache of per-graph results, keyed by the graph hash.
+
+    Every entry (metrics, neighbour arrays, spectra, ...) is a pickle file in the
+    directory of its graph. Hits refresh the modification time and the least
+    recently used files are removed when the cache grows above max_bytes. The
+    size of the cache is walked once and then kept as a running total; the
+    directory is walked again (which also counts the entries of other processes)
+    only when the total goes above the limit."""
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.total = sum(e[1] for e in self.entries())
+
+    def path(self, key, name):
+        return os.path.join(self.directory, key, name + ".pkl")
+
+    def get(self, key, name):
+        path = self.path(key, name)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        # mark as recently used
+        os.utime(path)
+        return value
+
+    def put(self, key, name, value):
+        path = self.path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # size of the entry being replaced
+        old = os.path.getsize(path) if os.path.exists(path) else 0
+        # write to a temporary file first so readers never see partial entries
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        os.replace(path + ".tmp", path)
+        self.total += size - old
+        if self.total > self.max_bytes:
+            self.evict()
+
+    def get_or_compute(self, key, name, function):
+        value = self.get(key, name)
+        if value is None:
+            value = function()
+            self.put(key, name, value)
+        return value
+
+    # (mtime, size, path) of the cached files
+    def entries(self):
+        entries = []
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                # skip the files being written by other processes
+                if f.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, f)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # removed by another process meanwhile
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    # remove least recently used entries above the size limit, down to 90% of it
+    # so that the next walks are not needed on every put of a full cache
+    def evict(self):
+        entries = self.entries()
+        self.total = sum(e[1] for e in entries)
+        if self.total <= self.max_bytes:
+            return
+        for mtime, size, path in sorted(entries):
+            if self.total <= 0.9*self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total -= size
+            # drop the graph directory once empty
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                # not empty (or already removed)
+                pass
+
+# cached graph and node metrics
+def cached_graph_metrics(G, cache, params=None, seed=None):
+    return cache.get_or_compute(graph_hash(G, params, seed), "metrics", lambda: graph_metrics(G))
+
+# cached CSR neighbour lists and selection probabilities
+def cached_neighbour_arrays(G, cache, params=None, seed=None):
+    return cache.get_or_compute(graph_hash(G, params, seed), "neighbours", lambda: neighbour_arrays(G))
+
+# cached extreme eigenvalues
+def cached_spectra(G, cache, params=None, seed=None):
+    return cache.get_or_compute(graph_hash(G, params, seed), "spectra", lambda: spectral_metrics(G))
@@ -1,73 +1,169 @@
 import networkx as nx
+import numpy as np
+import scipy.sparse as sps
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 import random
 import math
 from FARZ import *
 
-# generate a connected Erdos-Renyi random graph
-def get_connected_erdos(N, p):
-    while True:
-        G = nx.erdos_renyi_graph(n = N, p = p, directed=False)
-        if nx.is_connected(G):
-            break
-    return G
+from csr_graph import *
 
-# generate a connected Geometric Random graph
-def get_connected_geometric(N, r):
+# edges of an Erdos-Renyi graph, skipping geometrically over the N(N-1)/2 node pairs (Batagelj and Brandes 2005)
+def erdos_edges(N, p, rng=np.random):
+    total = N*(N - 1)//2
+    if p <= 0 or total == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    # pair positions: cumulative sums of geometric gaps, drawn in blocks
+    blocks, last = [], -1
+    while last < total:
+        size = int(1.2*p*(total - last - 1)) + 100
+        k = last + np.cumsum(rng.geometric(p, size))
+        blocks.append(k)
+        last = k[-1]
+    k = np.concatenate(blocks)
+    k = k[k < total]
+    # pair k = v(v-1)/2 + w with w < v
+    v = ((1 + np.sqrt(1 + 8*k.astype(float)))/2).astype(np.int64)
+    v[v*(v - 1)//2 > k] -= 1
+    v[(v + 1)*v//2 <= k] += 1
+    return np.column_stack([v, k - v*(v - 1)//2])
+
+# edges of a random geometric graph in the unit square (pairs at distance <= r)
+def geometric_edges(N, r, rng=np.random):
+    pos = rng.uniform(size=(N, 2))
+    edges = cKDTree(pos).query_pairs(r, output_type="ndarray")
+    return edges.astype(np.int64).reshape(-1, 2), pos
+
+# component labels from the edge list (CSR adjacency)
+def components(N, edges):
+    A = sps.csr_matrix((np.ones(len(edges)), (edges[:, 0], edges[:, 1])), shape=(N, N))
+    return connected_components(A, directed=False)
+
+def connected_graph(N, sample, mode="connected", stats=None, csr=False):
+    """Connected graph from a sampler of (edges, positions) of N nodes.
+
+    In "connected" mode the graph is sampled until it is connected (each
+    rejected sample only costs a connectivity check on the edge list). In
+    "largest" mode a single sample is drawn and its largest component is
+    returned, relabelled 0..n-1. If a dictionary is given as stats, the number
+    of samples and the size of the largest component of each one are
+    recorded in it. With csr=True the graph is returned as a CSRGraph."""
+    if mode not in ("connected", "largest"):
+        raise ValueError("unknown mode " + str(mode))
+    attempts, sizes = 0, []
     while True:
-        G = nx.random_geometric_graph(N, r)
-        if nx.is_connected(G):
+        edges, pos = sample()
+        attempts += 1
+        n_comp, labels = components(N, edges)
+        counts = np.bincount(labels)
+        sizes.append(int(counts.max()))
+        if n_comp == 1 or mode == "largest":
             break
+    if n_comp > 1:
+        # keep the largest component and relabel its nodes
+        keep = labels == np.argmax(counts)
+        new_id = np.cumsum(keep) - 1
+        edges = new_id[edges[keep[edges[:, 0]]]]
+        pos = pos[keep] if pos is not None else None
+        N = int(keep.sum())
+    if stats is not None:
+        stats.update({"attempts": attempts, "retries": attempts - 1, "sizes": sizes})
+    if csr:
+        return CSRGraph.from_edges(N, edges, pos)
+    G = nx.empty_graph(N)
+    G.add_edges_from(edges.tolist())
+    if pos is not None:
+        nx.set_node_attributes(G, dict(enumerate(pos.tolist())), "pos")
     return G
 
-def _random_subset(seq, m):
-    # Return m unique elements from seq.
-    targets = set()
-    while len(targets) < m:
-        x = random.choice(seq)
-        targets.add(x)
-    return targets
+# generate a connected Erdos-Renyi random graph
+def get_connected_erdos(N, p, mode="connected", stats=None, rng=np.random, csr=False):
+    return connected_graph(N, lambda: (erdos_edges(N, p, rng), None), mode, stats, csr)
+
+# generate a connected Geometric Random graph
+def get_connected_geometric(N, r, mode="connected", stats=None, rng=np.random, csr=False):
+    return connected_graph(N, lambda: geometric_edges(N, r, rng), mode, stats, csr)
 
 # adapted from NetworkX
-def get_powerlaw_cluster_graph(n, a, p):
+def get_powerlaw_cluster_graph(n, a, p, csr=False):
+    """Holme and Kim algorithm for growing graphs with powerlaw
+    degree distribution and approximate average clustering.
+
+    The growth is sequential, so the edges, the nodes repeated once per
+    adjacent edge (for the preferential attachment) and the marks of the
+    nodes already linked to the new node are preallocated Python lists, which
+    are faster than NumPy arrays for scalar access. The graph is built once at
+    the end (as a CSRGraph with csr=True, which avoids most of the cost)."""
     m = int(a/2)
     count_p = 0
     count_c = 0
-    """Holme and Kim algorithm for growing graphs with powerlaw
-    degree distribution and approximate average clustering."""
-    G = nx.empty_graph(m)  # add m initial nodes (m0 in barabasi-speak)
-    repeated_nodes = list(G.nodes())  # list of existing nodes to sample from
-    # with nodes repeated once for each adjacent edge
+    # at most m edges per new node
+    size = m*max(n - m, 0)
+    sources, targets = [0]*size, [0]*size
+    n_edges = 0
+    # existing nodes, repeated once for each adjacent edge (m initial nodes)
+    repeated_nodes = list(range(m)) + [0]*(2*size)
+    n_repeated = m
+    neighbours = [[] for _ in range(n)]
+    # linked[u] == source if u is already linked to the new node
+    linked = [-1]*n
     source = m  # next node is m
     while source < n:  # Now add the other n-1 nodes
-        possible_targets = _random_subset(repeated_nodes, m)
+        # no self-loops
+        linked[source] = source
+        # m distinct targets chosen preferentially
+        possible_targets = set()
+        while len(possible_targets) < m:
+            possible_targets.add(repeated_nodes[int(random.random()*n_repeated)])
         # do one preferential attachment for new node
         target = possible_targets.pop()
-        G.add_edge(source, target)
         count_p += 1
-        repeated_nodes.append(target)  # add one node to list for each new link
-        count = 1
-        while count < m:  # add m-1 more new links
+        new = target
+        count = 0
+        while True:
+            # add the edge (a target may already be linked through a triangle)
+            if linked[new] != source:
+                linked[new] = source
+                sources[n_edges] = source
+                targets[n_edges] = new
+                n_edges += 1
+                neighbours[source].append(new)
+                neighbours[new].append(source)
+            repeated_nodes[n_repeated] = new  # add one node to list for each new link
+            n_repeated += 1
+            count += 1
+            if count == m:
+                break
+            new = -1
             if random.random() < p:  # clustering step: add triangle
-                neighborhood = [
-                    nbr
-                    for nbr in G.neighbors(target)
-                    if not G.has_edge(source, nbr) and not nbr == source
-                ]
-                if neighborhood:  # if there is a neighbor without a link
-                    nbr = random.choice(neighborhood)
-                    G.add_edge(source, nbr)  # add triangle
+                candidates = neighbours[target]
+                # random neighbour of the target not linked to the source yet
+                for _ in range(8):
+                    u = candidates[int(random.random()*len(candidates))]
+                    if linked[u] != source:
+                        new = u
+                        break
+                else:
+                    free = [u for u in candidates if linked[u] != source]
+                    if free:
+                        new = random.choice(free)
+                if new >= 0:  # if there is a neighbor without a link
                     count_c += 1
-                    repeated_nodes.append(nbr)
-                    count = count + 1
-                    continue  # go to top of while loop
-            # else do preferential attachment step if above fails
-            target = possible_targets.pop()
-            G.add_edge(source, target)
-            count_p += 1
-            repeated_nodes.append(target)
-            count = count + 1
-        repeated_nodes.extend([source] * m)  # add source node to list m times
+            if new < 0:
+                # else do preferential attachment step if above fails
+                target = possible_targets.pop()
+                count_p += 1
+                new = target
+        # add source node to list m times
+        repeated_nodes[n_repeated:n_repeated + m] = [source]*m
+        n_repeated += m
         source += 1
+    edges = np.column_stack([np.array(sources[:n_edges], dtype=np.int64), np.array(targets[:n_edges], dtype=np.int64)])
+    if csr:
+        return CSRGraph.from_edges(n, edges), count_p, count_c
+    G = nx.empty_graph(n)
+    G.add_edges_from(edges.tolist())
     return G, count_p, count_c
 
 # generate a community based random graph (adapted from FARZ)
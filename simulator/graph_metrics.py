@@ -2,6 +2,12 @@ import scipy as sp
 import scipy.stats as ss
 import numpy as np
 import networkx as nx
+import scipy.sparse as sps
+from scipy.sparse.linalg import eigsh
+from scipy.sparse.csgraph import shortest_path
+from concurrent.futures import ProcessPoolExecutor
+
+from csr_graph import *
 
 # calculate error Denantes et al. 2016
 def error_norm(values):
@@ -13,111 +19,367 @@ def error_boyd(values, V0):
     avg = np.mean(values)
     return np.sum((values - avg)**2)**0.5/np.sum((np.array(V0))**2)**0.5
 
-# calculate nodes and graph metrics
-def graph_metrics(G):
-    # empty dictionary to store statistics
-    stats_net = {}
-    stats_node = {}
+# summary statistics of a node metric
+def summary(stats_net, name, values):
+    stats_net["avg_" + name] = np.mean(values)
+    stats_net["std_" + name] = np.std(values)
+    stats_net["max_" + name] = np.max(values)
+    stats_net["min_" + name] = np.min(values)
+    stats_net["skew_" + name] = ss.skew(values)
+
+###########################################################################################################################
+# METRIC FAMILIES
+# each family takes the graph (networkx or CSRGraph), the shared inputs it depends on
+# and the options, and returns its graph metrics, node metrics and (in approximate mode) error estimates
 
-    # compute distance measures or measures of non centrality (6)
-    ecc = list(nx.eccentricity(G).values()) 
-    stats_node["ecc"] = ecc        
+# compute distance measures or measures of non centrality (6)
+def ecc_metrics(G, inputs, options):
+    dist = inputs["distances"]
+    # node values (NaN for the nodes without an eccentricity in approximate mode)
+    node_ecc = dist["ecc"]
+    ecc = [e for e in node_ecc if not np.isnan(e)] if options["approx"] else node_ecc
+    stats_net = {}
     stats_net["avg_ecc"] = np.mean(ecc)    # average eccentricity
     stats_net["med_ecc"] = np.median(ecc)  # median eccentricity
     stats_net["std_ecc"] = np.std(ecc)     # standard deviation of eccentricity
-    stats_net["diameter"] = np.max(ecc)             # maximum eccentricity (diameter)
-    stats_net["radius"] = np.min(ecc)               # minimum eccentricity (radius)
+    stats_net["diameter"] = dist.get("diameter", np.max(ecc))   # maximum eccentricity (diameter)
+    stats_net["radius"] = dist.get("radius", np.min(ecc))       # minimum eccentricity (radius)
     stats_net["skew_ecc"] = ss.skew(ecc)   # eccentricity skewness
-    
-    # compute centrality measures (20)
+    errors = {key: dist["errors"][key] for key in ("err_ecc", "diameter_ub", "radius_lb")} if options["approx"] else {}
+    return stats_net, {"ecc": node_ecc}, errors
+
+# compute centrality measures (20)
+def degree_metrics(G, inputs, options):
+    G = as_networkx(G)
     deg = list(nx.degree_centrality(G).values())
-    stats_node["degree_c"] = deg
-    stats_net["avg_degree"] = np.mean(deg)  # average degree
-    stats_net["std_degree"] = np.std(deg)   # standard deviation of degree
-    stats_net["max_degree"] = np.max(deg)   # maximum degree
-    stats_net["min_degree"] = np.min(deg)   # minimum degree
-    stats_net["skew_degree"] = ss.skew(deg) # degree skewness
-
-    clos = list(nx.closeness_centrality(G).values()) # closeness centrality
-    stats_node["clos_c"] = clos
-    stats_net["avg_clos"] = np.mean(clos)
-    stats_net["std_clos"] = np.std(clos)
-    stats_net["max_clos"] = np.max(clos)
-    stats_net["min_clos"] = np.min(clos)
-    stats_net["skew_clos"] = ss.skew(clos)
-
-    betw = list(nx.betweenness_centrality(G).values()) # betweenness centrality
-    stats_node["betw_c"] = betw
-    stats_net["avg_betw"] = np.mean(betw)
-    stats_net["std_betw"] = np.std(betw)
-    stats_net["max_betw"] = np.max(betw)
-    stats_net["min_betw"] = np.min(betw)
-    stats_net["skew_betw"] = ss.skew(betw)
+    stats_net = {}
+    summary(stats_net, "degree", deg)
+    return stats_net, {"degree_c": deg}, {}
+
+def closeness_metrics(G, inputs, options):
+    dist = inputs["distances"]
+    clos = dist["clos"] # closeness centrality
+    stats_net = {}
+    summary(stats_net, "clos", clos)
+    errors = {"err_clos": dist["errors"]["err_clos"]} if options["approx"] else {}
+    return stats_net, {"clos_c": clos}, errors
+
+def betweenness_metrics(G, inputs, options):
+    G = as_networkx(G)
+    errors = {}
+    if options["approx"]:
+        k, seed = options["k"], options["seed"]
+        # two independent halves of the sources, their difference estimates the error
+        betw1 = np.array(list(nx.betweenness_centrality(G, k=k//2, seed=seed).values()))
+        betw2 = np.array(list(nx.betweenness_centrality(G, k=k - k//2, seed=None if seed is None else seed + 1).values()))
+        betw = list((betw1*(k//2) + betw2*(k - k//2))/k)
+        errors["err_betw"] = np.mean(np.abs(betw1 - betw2))/2/np.mean(betw)
+    else:
+        betw = list(nx.betweenness_centrality(G).values()) # betweenness centrality
+    stats_net = {}
+    summary(stats_net, "betw", betw)
+    return stats_net, {"betw_c": betw}, errors
 
+def eigenvector_metrics(G, inputs, options):
+    G = as_networkx(G)
+    stats_net = {}
     try:
         eig = list(nx.eigenvector_centrality(G, max_iter=5000).values()) # eigenvector centrality
-        stats_node["eig_c"] = eig
-        stats_net["avg_eig"] = np.mean(eig)
-        stats_net["std_eig"] = np.std(eig)
-        stats_net["max_eig"] = np.max(eig)
-        stats_net["min_eig"] = np.min(eig)
-        stats_net["skew_eig"] = ss.skew(eig)
+        summary(stats_net, "eig", eig)
+        return stats_net, {"eig_c": eig}, {}
     except:
         stats_net["avg_eig"] = np.nan
         stats_net["std_eig"] = np.nan
         stats_net["max_eig"] = np.nan
         stats_net["min_eig"] = np.nan
         stats_net["skew_eig"] = np.nan
-        
-    # connectivity measures (5)
-    clust = list(nx.clustering(G).values()) # clustering
-    stats_node["clust_c"] = clust
-    stats_net["avg_clust"] = np.mean(clust) # transitivity : nx.transitivity(G)
-    stats_net["std_clust"] = np.std(clust)
-    stats_net["max_clust"] = np.max(clust)
-    stats_net["min_clust"] = np.min(clust)
-    stats_net["skew_clust"] = ss.skew(clust)
-
-    # efficiency (5)
-    eff = [nx.global_efficiency(G.subgraph(G[v])) for v in G]
-    stats_node["eff"] = eff
-    stats_net["avg_eff"] = np.mean(eff) # local efficiency : nx.local_efficiency(G)
-    stats_net["std_eff"] = np.std(eff)
-    stats_net["max_eff"] = np.max(eff)
-    stats_net["min_eff"] = np.min(eff)
-    stats_net["skew_eff"] = ss.skew(eff)
-
-    # Global efficiency
-    stats_net["glb_eff"] = nx.global_efficiency(G)
-
-    # Shannon entropy degree
+        return stats_net, {}, {}
+
+# connectivity measures (5)
+def clustering_metrics(G, inputs, options):
+    clust = list(inputs["triangles"][0]) # clustering
+    stats_net = {}
+    summary(stats_net, "clust", clust) # transitivity : nx.transitivity(G)
+    return stats_net, {"clust_c": clust}, {}
+
+# efficiency (5)
+def efficiency_metrics(G, inputs, options):
+    eff = list(inputs["triangles"][1])
+    stats_net = {}
+    summary(stats_net, "eff", eff) # local efficiency : nx.local_efficiency(G)
+    return stats_net, {"eff": eff}, {}
+
+# Global efficiency
+def global_efficiency_metrics(G, inputs, options):
+    dist = inputs["distances"]
+    errors = {"err_glb_eff": dist["errors"]["err_glb_eff"]} if options["approx"] else {}
+    return {"glb_eff": dist["glb_eff"]}, {}, errors
+
+# Shannon entropy degree
+def entropy_metrics(G, inputs, options):
+    G = as_networkx(G)
     degree_sequence = sorted([d for n, d in G.degree()], reverse=True)  # degree sequence
     count = np.bincount(degree_sequence)
-    stats_net["entropy_degree"] = ss.entropy(count[count != 0] / sum(count)) 
+    return {"entropy_degree": ss.entropy(count[count != 0] / sum(count))}, {}, {}
 
-    # Assortativity coefficient
-    stats_net["assort_corr"] = nx.degree_pearson_correlation_coefficient(G)
-    
-    # Average Shortest Path length
-    stats_net["avg_short_path"] = nx.average_shortest_path_length(G)    
+# Assortativity coefficient
+def assortativity_metrics(G, inputs, options):
+    G = as_networkx(G)
+    return {"assort_corr": nx.degree_pearson_correlation_coefficient(G)}, {}, {}
+
+# Average Shortest Path length and Weiner Index
+def path_metrics(G, inputs, options):
+    dist = inputs["distances"]
+    errors = {"err_aspl": dist["errors"]["err_aspl"]} if options["approx"] else {}
+    return {"avg_short_path": dist["avg_short_path"], "w_ind": dist["w_ind"]}, {}, errors
+
+# spectral properties (extreme eigenvalues) (8)
+def spectral_family(G, inputs, options):
+    return inputs["spectra"], {}, {}
+
+# shared inputs of the metric families
+metric_inputs = {"distances": lambda G, options: sampled_distance_metrics(G, options["k"], options["seed"])
+                                                 if options["approx"] else distance_metrics(G),
+                 "triangles": lambda G, options: local_metrics(G),
+                 "spectra": lambda G, options: spectral_metrics(G)}
+
+# metric families (in output order) and the shared inputs they depend on
+metric_families = {"eccentricity": (ecc_metrics, ["distances"]),
+                   "degree": (degree_metrics, []),
+                   "closeness": (closeness_metrics, ["distances"]),
+                   "betweenness": (betweenness_metrics, []),
+                   "eigenvector": (eigenvector_metrics, []),
+                   "clustering": (clustering_metrics, ["triangles"]),
+                   "efficiency": (efficiency_metrics, ["triangles"]),
+                   "global_efficiency": (global_efficiency_metrics, ["distances"]),
+                   "entropy": (entropy_metrics, []),
+                   "assortativity": (assortativity_metrics, []),
+                   "path": (path_metrics, ["distances"]),
+                   "spectral": (spectral_family, ["spectra"])}
+
+# compute a group of families sharing the same inputs
+def run_metric_group(G, families, options):
+    inputs = {}
+    results = {}
+    for name in families:
+        function, requires = metric_families[name]
+        for dep in requires:
+            if dep not in inputs:
+                inputs[dep] = metric_inputs[dep](G, options)
+        results[name] = function(G, inputs, options)
+    return results
+
+# calculate nodes and graph metrics
+def graph_metrics(G, metrics=None, workers=None, approx=False, k=256, seed=None):
+    """Graph metrics (stats_net) and node metrics (stats_node).
+
+    metrics selects a subset of the families in metric_families (default: all);
+    unknown names raise a ValueError.
+    Families sharing an input (BFS distances, triangles, spectra) are grouped so
+    that the input is computed once, and with workers set the groups run
+    concurrently in a process pool.
+    With approx=True and more than k nodes, distance metrics, closeness and
+    betweenness are estimated from k sampled sources, and the diameter and radius
+    from a double sweep. stats_net then also records approx=True and the error
+    estimates of these metrics."""
+    unknown = [name for name in (metrics or []) if name not in metric_families]
+    if unknown:
+        raise ValueError("unknown metric families " + str(unknown) + ", choose from " + str(list(metric_families)))
+    families = [name for name in metric_families if metrics is None or name in metrics]
+    options = {"approx": approx and k < G.number_of_nodes(), "k": k, "seed": seed}
+    # one group per shared input, independent families on their own
+    groups = {}
+    for name in families:
+        requires = metric_families[name][1]
+        groups.setdefault(requires[0] if requires else name, []).append(name)
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = pool.map(run_metric_group, [G]*len(groups), groups.values(), [options]*len(groups))
+            results = {key: value for part in parts for key, value in part.items()}
+    else:
+        results = {key: value for group in groups.values() for key, value in run_metric_group(G, group, options).items()}
+
+    # empty dictionary to store statistics
+    stats_net = {}
+    stats_node = {}
+    errors = {}
+    for name in families:
+        net, node, err = results[name]
+        stats_net.update(net)
+        stats_node.update(node)
+        errors.update(err)
+
+    # sampled metrics and their (relative) error estimates
+    if options["approx"]:
+        stats_net["approx"] = True
+        stats_net.update(errors)
     
-    # Weiner Index
-    stats_net["w_ind"] = nx.wiener_index(G)          
+    return stats_net, stats_node
+
+def local_metrics(G, dense_max=5000):
+    """Clustering and local efficiency of every node from the sparse adjacency.
+
+    Clustering uses the triangle counts diag(A·A∘A). The efficiency of the
+    neighbourhood of v runs a BFS from all its neighbours at once with boolean
+    products of the adjacency restricted to the neighbourhood, and adds the
+    pairs at distance d as count/d. The result equals nx.local_efficiency up to
+    floating-point round-off (about 1e-14, from a different summation order
+    when neighbourhoods contain paths of length 3 or more); it is not
+    bit-identical. Edge weights are ignored, as in nx.clustering."""
+    n = G.number_of_nodes()
+    A = adjacency(G)
+    A.setdiag(0)
+    A.eliminate_zeros()
+    deg = np.diff(A.indptr)
+    # twice the number of triangles at each node
+    tri = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel().astype(np.int64)
+    clust = np.divide(tri, deg*(deg - 1), out=np.zeros(n), where=tri > 0)
+    # neighbourhood subgraphs from a dense copy when it fits in memory
+    dense = A.toarray() > 0 if n <= dense_max else None
+    eff = np.zeros(n)
+    for v in range(n):
+        nb = A.indices[A.indptr[v]:A.indptr[v+1]]
+        k = len(nb)
+        if k < 2:
+            continue
+        S = dense[np.ix_(nb, nb)] if dense is not None else A[nb][:, nb].toarray() > 0
+        # pairs at distance 1, then one BFS level at a time
+        total = S.sum()
+        visited = S | np.eye(k, dtype=bool)
+        frontier = S
+        d = 1
+        while True:
+            frontier = (frontier @ S) & ~visited
+            count = frontier.sum()
+            if count == 0:
+                break
+            d += 1
+            total = total + count/d
+            visited |= frontier
+        eff[v] = total/(k*(k - 1))
+    return clust, eff
+
+# distance statistics of a chunk of sources
+def bfs_chunk(A, sources):
+    D = shortest_path(A, method="D", unweighted=True, indices=sources)
+    reached = np.isfinite(D)
+    D[~reached] = 0
+    inv = np.divide(1, D, out=np.zeros_like(D), where=D > 0)
+    return D.max(axis=1), D.sum(axis=1), reached.sum(axis=1) - 1, inv.sum()
+
+def distance_metrics(G, chunk_size=256, workers=None):
+    """Eccentricity, closeness, average shortest path, Wiener index and global efficiency.
+
+    All five are derived from a single BFS per source on the CSR adjacency,
+    run in chunks of sources (in a process pool if workers is given). Values
+    match the networkx functions for connected graphs."""
+    n = G.number_of_nodes()
+    A = adjacency(G)
+    chunks = [np.arange(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+    if workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(bfs_chunk, [A]*len(chunks), chunks))
+    else:
+        parts = [bfs_chunk(A, c) for c in chunks]
+    ecc = np.concatenate([p[0] for p in parts])
+    totsp = np.concatenate([p[1] for p in parts])
+    reached = np.concatenate([p[2] for p in parts])
+    inv_sum = sum(p[3] for p in parts)
+
+    dist = {}
+    dist["ecc"] = [int(e) for e in ecc]
+    # closeness with the Wasserman and Faust correction (as networkx)
+    clos = np.divide(reached, totsp, out=np.zeros(n), where=totsp > 0)
+    dist["clos"] = list(clos * (reached/(n - 1))) if n > 1 else [0.0]*n
+    dist["avg_short_path"] = totsp.sum()/(n*(n - 1))
+    dist["w_ind"] = totsp.sum()/2 if np.all(reached == n - 1) else float("inf")
+    dist["glb_eff"] = inv_sum/(n*(n - 1)) if n > 1 else 0
+    return dist
+
+def sampled_distance_metrics(G, k, seed=None):
+    """Estimates of the distance_metrics from BFS on k sampled sources.
+
+    Eccentricities are only known for the sampled sources (NaN for the other
+    nodes) and their statistics are those of the sources, closeness uses the
+    mean distance to the sampled sources, and the averages over pairs use the
+    sampled rows. The diameter is the largest eccentricity found (including a
+    double sweep, a lower bound) and the radius the smallest (an upper bound).
+    Errors are relative standard errors, plus the bounds on diameter and radius."""
+    rng = np.random.default_rng(seed)
+    n = G.number_of_nodes()
+    A = adjacency(G)
+    sources = rng.choice(n, size=k, replace=False)
+    D = shortest_path(A, method="D", unweighted=True, indices=sources)
+    D[~np.isfinite(D)] = 0
+    src_ecc = D.max(axis=1)
+    # double sweep: BFS from the farthest node of the first source
+    far = shortest_path(A, method="D", unweighted=True, indices=[np.argmax(D[0])])
+    far_ecc = far[np.isfinite(far)].max()
+    diameter = max(src_ecc.max(), far_ecc)
+    radius = min(src_ecc.min(), far_ecc)
+
+    dist = {}
+    # eccentricity of the sampled sources only (NaN for the other nodes)
+    ecc = np.full(n, np.nan)
+    ecc[sources] = src_ecc
+    dist["ecc"] = list(ecc)
+    dist["diameter"] = int(diameter)
+    dist["radius"] = int(radius)
+    # mean distance of every node to the sampled sources (other than itself)
+    count = k - np.isin(np.arange(n), sources)
+    mean_d = D.sum(axis=0)/count
+    dist["clos"] = list(1/mean_d)
+    # per-source averages over the other nodes
+    inv = np.divide(1, D, out=np.zeros_like(D), where=D > 0)
+    aspl = D.sum(axis=1)/(n - 1)
+    eff = inv.sum(axis=1)/(n - 1)
+    dist["avg_short_path"] = np.mean(aspl)
+    dist["w_ind"] = np.mean(aspl)*n*(n - 1)/2
+    dist["glb_eff"] = np.mean(eff)
+    # error estimates
+    dev_d = np.sqrt(np.maximum((D**2).sum(axis=0)/count - mean_d**2, 0))
+    dist["errors"] = {"err_ecc": np.std(src_ecc)/np.sqrt(k)/np.mean(src_ecc),
+                      "err_clos": np.mean(dev_d/np.sqrt(count)/mean_d),
+                      "err_aspl": np.std(aspl)/np.sqrt(k)/np.mean(aspl),
+                      "err_glb_eff": np.std(eff)/np.sqrt(k)/np.mean(eff),
+                      "diameter_ub": int(2*radius),
+                      "radius_lb": int(np.ceil(diameter/2))}
+    return dist
+
+# extreme eigenvalues of the Laplacian and adjacency matrices
+def spectral_metrics(G, dense_max=100):
+    """Two largest and two smallest eigenvalues of the adjacency and Laplacian spectra.
+
+    Both matrices are built once from the same sparse adjacency. Above dense_max
+    nodes only the extreme eigenvalues are computed with ARPACK (plain Lanczos, as
+    shift-invert factorizes L and is very slow on large graphs) instead of the
+    full spectra."""
+    stats_net = {}
+    A = adjacency(G)
+    L = sps.csr_matrix(sps.diags(np.asarray(A.sum(axis=1)).ravel()) - A)
+
+    if G.number_of_nodes() <= dense_max:
+        eig_laplacian = sorted(np.linalg.eigvalsh(L.toarray()), reverse=True)
+        eig_adjecency = sorted(np.linalg.eigvalsh(A.toarray()), reverse=True)
+    else:
+        lapl_top = eigsh(L, k=2, which="LA", return_eigenvectors=False)
+        lapl_bottom = eigsh(L, k=2, which="SA", return_eigenvectors=False)
+        eig_laplacian = sorted(np.concatenate([lapl_top, lapl_bottom]), reverse=True)
+        adj_top = eigsh(A, k=2, which="LA", return_eigenvectors=False)
+        adj_bottom = eigsh(A, k=2, which="SA", return_eigenvectors=False)
+        eig_adjecency = sorted(np.concatenate([adj_top, adj_bottom]), reverse=True)
 
-    # spectral properties (extreme eigenvalues) (8)
-    eig_laplacian = sorted(nx.laplacian_spectrum(G).real, reverse=True)
     stats_net["l1_lapl"] = eig_laplacian[0]
     stats_net["l2_lapl"] = eig_laplacian[1]
     #stats_net["ln_lapl"] = eig_laplacian[-1]
     stats_net["ln_1_lapl"] = eig_laplacian[-2]   # algebraic connectivity : nx.algebraic_connectivity(G, method='lanczos')
 
-    eig_adjecency = sorted(nx.adjacency_spectrum(G).real, reverse=True)
     stats_net["l1_adj"] = eig_adjecency[0]       # spectral radius
     stats_net["l2_adj"] = eig_adjecency[1]
     stats_net["ln_adj"] = eig_adjecency[-1]
     stats_net["ln_1_adj"] = eig_adjecency[-2]
-    
-    return stats_net, stats_node
+
+    return stats_net
 
 
 
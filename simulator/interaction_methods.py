@@ -6,25 +6,40 @@ import numpy as np
 
 # random selection
 def random_selection(self):
-    return random.choice(self.neighbours)
+    return self.neighbours[self.model.stream.index(len(self.neighbours))]
 
 # ordered selection
 def ordered_selection(self):
     # select nodes in order
     return self.neighbours[self.move_count%len(self.neighbours)]
 
+# draw from an alias table (neighbours, keep probabilities, aliases)
+def alias_selection(table, stream):
+    neighbours, prob, alias = table
+    k = stream.index(len(neighbours))
+    return neighbours[k] if stream.uniform() < prob[k] else alias[k]
+
 # degree selection
 def degree_selection(self):
     # get neighbour with weighted probability
+    if self.degree_alias is not None:
+        return alias_selection(self.degree_alias, self.model.stream)
     return np.random.choice(self.neighbours, 1, p = self.degree_p)[0]
 
 # distance selection
 def distance_selection(self):
+    if self.distance_alias is not None:
+        return alias_selection(self.distance_alias, self.model.stream)
     return np.random.choice(self.neighbours, 1, p = self.distance_p)[0]
 
 ###########################################################################################################################
 # INTERACTION
 
+# Every rule is an agent method interact(self, neigh) with two array versions:
+# pair(a, b) returns the new values of the agent and of its neighbour, and
+# batch(values, i, j) updates values in place for arrays of pairs (i, j) with no
+# agent in two pairs (the pairs then commute). Equal values are left unchanged.
+
 # define functions for interaction
 def simple_mean(self, neigh):
     # calculate the mean of the two values
@@ -35,14 +50,68 @@ def simple_mean(self, neigh):
     # return updated nodes
     return self, neigh
 
+def simple_mean_pair(a, b):
+    new_value = (a + b)/2
+    return new_value, new_value
+
+def simple_mean_batch(values, i, j):
+    new_value = (values[i] + values[j])/2
+    values[i] = new_value
+    values[j] = new_value
+
+simple_mean.pair = simple_mean_pair
+simple_mean.batch = simple_mean_batch
+
+# agent method from the pair rule
+def interaction_kernel(pair, batch):
+    def interact(self, neigh):
+        self.value, neigh.value = pair(self.value, neigh.value)
+        # return updated nodes
+        return self, neigh
+    interact.pair = pair
+    interact.batch = batch
+    return interact
+
+def convergence(cp):
+    """Both agents move towards each other by a fraction cp of their distance
+    (the neighbour towards the updated value of the agent)."""
+    def pair(a, b):
+        # update own value
+        a = a + cp*(b - a)
+        # update other value
+        return a, b + cp*(a - b)
+    def batch(values, i, j):
+        values[i], values[j] = pair(values[i], values[j])
+    return interaction_kernel(pair, batch)
+
+def dual_convergence(hcp, lcp, threshold):
+    """convergence with rate hcp if the values are closer than threshold and lcp otherwise
+    (bdp*std in the original model)."""
+    def pair(a, b):
+        # check condition for high convergence
+        c = hcp if abs(a - b) < threshold else lcp
+        a = a + c*(b - a)
+        return a, b + c*(a - b)
+    def batch(values, i, j):
+        a, b = values[i], values[j]
+        c = np.where(np.abs(a - b) < threshold, hcp, lcp)
+        a = a + c*(b - a)
+        values[i] = a
+        values[j] = b + c*(a - b)
+    return interaction_kernel(pair, batch)
+
+def bounded_confidence(cp, threshold):
+    """convergence with rate cp only if the values are closer than threshold."""
+    return dual_convergence(cp, 0, threshold)
+
 ###########################################################################################################################
 # TIME
   
 def next_poisson(self, paramt):
-    return ss.poisson(paramt).rvs() + 1
+    return self.model.stream.poisson(paramt) + 1
 
 def next_expo(self, paramt):
-    return random.expovariate(1 / paramt) 
+    return self.model.stream.exponential(paramt)
 
 
 #def next_move_d(self):
@@ -50,47 +119,3 @@ def next_expo(self, paramt):
 
 #def next_move_c(self):
 #    return random.expovariate(1 / 5) 
-"""
-def convergence(self, neigh):
-    # update own value
-    self.value = self.value + cp*(neigh.value - self.value)
-    # update other value
-    neigh.value = neigh.value + cp*(self.value - neigh.value)
-    # return updated nodes
-    return self, neigh
-
-def dual_convergence(self, neigh):
-    # check condition for high convergence
-    if (np.abs(self.value - neigh.value) < bdp*std):
-        # update own value
-        self.value = self.value + hcp*(neigh.value - self.value)
-        # update other value
-        neigh.value = neigh.value + hcp*(self.value - neigh.value)
-    else:
-        # update own value
-        self.value = self.value + lcp*(neigh.value - self.value)
-        # update other value
-        neigh.value = neigh.value + lcp*(self.value - neigh.value)    
-    # return updated nodes
-    return self, neigh
-
-def bounded_confidence(self, neigh):
-    # check condition for high convergence
-    if (np.abs(self.value - neigh.value) < bdp*std):
-        # update own value
-        self.value = self.value + cp*(neigh.value - self.value)
-        # update other value
-        neigh.value = neigh.value + cp*(self.value - neigh.value) 
-    # return updated nodes
-    return self, neigh
-"""
-
-
-
-
-
-
-
-
-
-
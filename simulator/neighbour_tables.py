@@ -0,0 +1,77 @@
+import numpy as np
+
+from graph_cache import *
+
+
+# Walker alias table of a discrete distribution (Vose's method)
+def alias_table(p):
+    k = len(p)
+    q = np.asarray(p, dtype=float) * k
+    prob = np.ones(k)
+    alias = np.arange(k)
+    small = [i for i in range(k) if q[i] < 1]
+    large = [i for i in range(k) if q[i] >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = q[s]
+        alias[s] = l
+        q[l] = q[l] - (1 - q[s])
+        if q[l] < 1:
+            small.append(l)
+        else:
+            large.append(l)
+    return prob, alias
+
+class NeighbourTables():
+    """Neighbour lists and selection probabilities of a graph, built once per graph.
+
+    Holds the CSR neighbour lists and the degree and distance selection
+    probabilities. Agents of every replicate take slices of these arrays
+    instead of recomputing them; the order of each list is shuffled per
+    replicate with a single vectorized permutation.
+    Weighted selection uses Walker alias tables: entry e of row i keeps the
+    neighbour indices[e] with probability *_alias_p[e] and otherwise returns
+    the neighbour *_alias[e], so a draw takes two uniforms whatever the degree."""
+    def __init__(self, G, cache=None):
+        arrays = cached_neighbour_arrays(G, cache) if cache is not None else neighbour_arrays(G)
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.degree_p = arrays["degree_p"]
+        self.distance_p = arrays["distance_p"]
+        self.degree = np.diff(self.indptr)
+        # node owning every entry
+        self.row = np.repeat(np.arange(len(self.degree)), self.degree)
+        # alias tables of the weighted selections
+        self.degree_alias_p, self.degree_alias = self.alias_tables(self.degree_p)
+        self.distance_alias_p, self.distance_alias = self.alias_tables(self.distance_p)
+
+    # alias tables of every row (aliases stored as neighbour ids)
+    def alias_tables(self, p):
+        prob = np.ones(len(p))
+        alias = self.indices.copy()
+        for i in range(len(self.degree)):
+            a, b = self.indptr[i], self.indptr[i+1]
+            if b > a:
+                row_prob, row_alias = alias_table(p[a:b])
+                prob[a:b] = row_prob
+                alias[a:b] = self.indices[a + row_alias]
+        return prob, alias
+
+    # draw neighbours of the nodes src from an alias table, given two uniforms per draw
+    def draw(self, src, u, v, prob, alias):
+        e = self.indptr[src] + (u * self.degree[src]).astype(np.int64)
+        return np.where(v < prob[e], self.indices[e], alias[e])
+
+    # random order of every neighbour list (entries stay within their row)
+    def shuffle(self, rng=np.random):
+        return np.lexsort((rng.random(len(self.indices)), self.row))
+
+    # neighbours and selection probabilities of node i in the given order
+    def get(self, i, order=None):
+        pos = np.arange(self.indptr[i], self.indptr[i+1]) if order is None else order[self.indptr[i]:self.indptr[i+1]]
+        return self.indices[pos].tolist(), self.degree_p[pos], self.distance_p[pos]
+
+    # alias tables of node i: (neighbours, keep probabilities, aliases) as lists
+    def get_alias(self, i, prob, alias):
+        a, b = self.indptr[i], self.indptr[i+1]
+        return self.indices[a:b].tolist(), prob[a:b].tolist(), alias[a:b].tolist()
@@ -0,0 +1,47 @@
+import math
+
+import numpy as np
+
+
+class RandomStream():
+    """Random numbers handed out one at a time from pre-drawn blocks.
+
+    Blocks of uniforms and standard exponentials are drawn from a numpy
+    Generator and refilled when empty. Poisson variates are obtained from the
+    uniforms by inversion (no block per rate, so agents with many different
+    speeds cost no memory). Seeding the stream of every replicate makes the
+    whole run reproducible."""
+    def __init__(self, seed=None, block_size=4096):
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self.uniforms = []
+        self.exponentials = []
+
+    def uniform(self):
+        if not self.uniforms:
+            self.uniforms = self.rng.random(self.block_size).tolist()
+        return self.uniforms.pop()
+
+    # random index in range(n)
+    def index(self, n):
+        return int(self.uniform()*n)
+
+    # exponential waiting time with mean scale
+    def exponential(self, scale):
+        if not self.exponentials:
+            self.exponentials = self.rng.standard_exponential(self.block_size).tolist()
+        return self.exponentials.pop()*scale
+
+    # Poisson variate by inversion of the CDF (direct draw for large rates)
+    def poisson(self, lam):
+        if lam > 30:
+            return int(self.rng.poisson(lam))
+        u = self.uniform()
+        k = 0
+        p = math.exp(-lam)
+        cdf = p
+        while u > cdf and p > 0:
+            k += 1
+            p *= lam/k
+            cdf += p
+        return k
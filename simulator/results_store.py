@@ -0,0 +1,42 @@
+import json, sqlite3
+
+import pandas as pd
+
+
+class ResultsStore():
+    """Append-only SQLite store of sweep results.
+
+    Every row is keyed by its graph parameters and seed and written (and
+    committed) as soon as it is appended, so an interrupted sweep loses at most
+    the graphs that were running. A restarted sweep skips the keys already done."""
+    key_columns = ("graph", "size", "avg", "p", "seed")
+
+    def __init__(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        # write-ahead log: appends do not rewrite the database
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS results (graph TEXT, size INTEGER, avg REAL, "
+                         "p REAL, seed INTEGER, row TEXT, PRIMARY KEY (graph, size, avg, p, seed))")
+        self.con.commit()
+
+    # key of a row (or of a grid point and seed)
+    def key(self, row):
+        return (str(row["graph"]), int(row["size"]), float(row["avg"]), float(row["p"]), int(row["seed"]))
+
+    def done_keys(self):
+        return set(self.con.execute("SELECT graph, size, avg, p, seed FROM results"))
+
+    def append(self, row):
+        # numpy scalars are stored as python numbers
+        payload = json.dumps(row, default=lambda x: x.item())
+        self.con.execute("INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)", self.key(row) + (payload,))
+        self.con.commit()
+
+    # all rows as a dataframe (e.g. to save the final csv)
+    def to_frame(self):
+        rows = [json.loads(r) for (r,) in self.con.execute("SELECT row FROM results ORDER BY rowid")]
+        return pd.DataFrame(rows)
+
+    def close(self):
+        self.con.close()
@@ -0,0 +1,56 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from csr_graph import *
+
+
+class SharedArrays():
+    """Arrays published once in shared memory for the workers of a process pool.
+
+    publish() copies an array into a new shared memory block and returns a
+    small picklable handle (block name, shape, dtype) to send in the task
+    messages; workers get a zero-copy view with attach(handle). The publisher
+    owns the blocks: use it as a context manager so that they are unlinked
+    when the work is done or fails."""
+    def __init__(self):
+        self.blocks = []
+
+    def publish(self, array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        return (block.name, array.shape, array.dtype.str)
+
+    # publish the arrays of a graph (CSRGraph or networkx)
+    def publish_graph(self, G):
+        G = as_csr(G)
+        return {"indptr": self.publish(G.indptr), "indices": self.publish(G.indices),
+                "pos": None if G.pos is None else self.publish(G.pos)}
+
+    def close(self):
+        while self.blocks:
+            block = self.blocks.pop()
+            block.close()
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# blocks attached in this process, kept open while their views are in use (closed when the worker exits)
+attached = {}
+
+def attach(handle):
+    name, shape, dtype = handle
+    if name not in attached:
+        # pool workers share the resource tracker of the publisher, which unlinks the block
+        attached[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=attached[name].buf)
+
+def attach_graph(handles):
+    pos = None if handles["pos"] is None else attach(handles["pos"])
+    return CSRGraph(attach(handles["indptr"]), attach(handles["indices"]), pos)
@@ -0,0 +1,65 @@
+import numpy as np
+import networkx as nx
+import scipy.sparse as sps
+from scipy.sparse.linalg import eigsh
+
+from csr_graph import *
+from interaction_methods import *
+
+
+# neighbour selection probabilities P[i, j] as a sparse matrix
+def selection_matrix(G, selection=random_selection):
+    A = as_csr(G).adjacency()
+    deg = np.asarray(A.sum(axis=1)).ravel()
+    if selection is degree_selection:
+        # weight of neighbour j: its degree
+        W = A @ sps.diags(deg)
+    elif selection is distance_selection:
+        # weight of neighbour j: 1/(common neighbours + 1)
+        common = (A @ A).multiply(A)
+        W = A.copy()
+        W.data = 1/(np.asarray(common[A.nonzero()]).ravel() + 1)
+    else:
+        # random (and, on average, ordered) selection: uniform over neighbours
+        W = A
+    W = sps.csr_matrix(W)
+    return sps.diags(1/np.asarray(W.sum(axis=1)).ravel()) @ W
+
+def expected_laplacian(G, selection=random_selection, speeds=None):
+    """Laplacian of the expected gossip matrix for simple_mean and Poisson clocks.
+
+    Agent i moves at rate 1/speed_i and averages with j with probability P[i, j];
+    the pair (i, j) then interacts at rate w_ij = (P[i, j]/speed_i + P[j, i]/speed_j)/2
+    and the deviation from the mean x decays as d E[|x|^2]/dt = -E[x' L x]."""
+    N = G.number_of_nodes()
+    rates = np.ones(N) if speeds is None else 1/np.asarray(speeds, dtype=float)
+    P = sps.diags(rates) @ selection_matrix(G, selection)
+    W = sps.csr_matrix((P + P.T)/2)
+    return sps.csr_matrix(sps.diags(np.asarray(W.sum(axis=1)).ravel()) - W)
+
+# algebraic connectivity of a Laplacian (sparse Lanczos, no shift-invert: factorizing L is slow)
+def second_eigenvalue(L):
+    if L.shape[0] <= 100:
+        return np.sort(np.linalg.eigvalsh(L.toarray()))[1]
+    vals = eigsh(L, k=2, which="SA", return_eigenvectors=False)
+    return np.sort(vals)[1]
+
+def predicted_rate(G, selection=random_selection, speeds=None):
+    """Spectral rates of the expected gossip Laplacian L.
+
+    Returns lambda_2(L), which bounds the decay rate of the mean-square error
+    E|x|^2 (and is the decay rate of the expected values), and lambda_2/2, the
+    bound of Boyd et al. 2005 on the decay of the RMS error sqrt(E|x|^2), i.e.
+    of the Boyd error whose log-slope contraction_rate fits."""
+    l2 = second_eigenvalue(expected_laplacian(G, selection, speeds))
+    return l2, l2/2
+
+def heuristic_rate(G, selection=random_selection, speeds=None):
+    """Heuristic estimate of the contraction rate of a single run (not a bound).
+
+    The smaller of lambda_2 and trace(L)/(2(N-1)), the average over all modes;
+    this combination was chosen because it matched past simulations better
+    than the Boyd bound, which underpredicts the rate on sparse graphs."""
+    L = expected_laplacian(G, selection, speeds)
+    average = L.diagonal().sum()/(2*(L.shape[0] - 1))
+    return min(second_eigenvalue(L), average)
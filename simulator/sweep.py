@@ -0,0 +1,142 @@
+import itertools, math, random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import networkx as nx
+
+from array_ABM import *
+from graph_generators import *
+from spectral_rate import *
+
+
+# default simulation parameters (as in the dataset scripts)
+default_config = {"max_time" : 50, # total simulation time
+                  "log_interval" : 1, # logging interval
+                  }
+
+# generate the parameter grid of a sweep
+def make_grid(families, sizes, avgs, probs=np.linspace(0,1,11)):
+    """List of graph parameter points for the chosen families.
+
+    ER and GR graphs take their probability/radius from size and average degree,
+    SW and SF graphs are generated for every rewiring/cluster probability in probs."""
+    grid = []
+    for (s, a) in itertools.product(*[sizes, avgs]):
+        for family in families:
+            if family == "ER":
+                grid.append({"graph": "ER", "size": s, "p": a/(s-1), "avg": a})
+            elif family == "GR":
+                grid.append({"graph": "GR", "size": s, "p": math.sqrt(a/(math.pi*s)), "avg": a})
+            elif family in ("SW", "SF"):
+                for p in probs:
+                    grid.append({"graph": family, "size": s, "p": p, "avg": a})
+            else:
+                raise ValueError("unknown graph family " + str(family))
+    return grid
+
+# generate the graph of a parameter point (as a CSRGraph)
+def make_graph(point):
+    s, a, p = point["size"], point["avg"], point["p"]
+    if point["graph"] == "ER":
+        return get_connected_erdos(s, p, csr=True)
+    if point["graph"] == "SW":
+        return CSRGraph.from_networkx(nx.connected_watts_strogatz_graph(s, a, p))
+    if point["graph"] == "SF":
+        G, count_p, count_c = get_powerlaw_cluster_graph(s, a, p, csr=True)
+        return G
+    if point["graph"] == "GR":
+        return get_connected_geometric(s, p, csr=True)
+    raise ValueError("unknown graph family " + str(point["graph"]))
+
+# seed the global generators used by the graph generators
+def seed_all(seed_seq):
+    state = seed_seq.generate_state(2)
+    random.seed(int(state[0]))
+    np.random.seed(int(state[1]))
+
+def run_task(task):
+    """Simulate one chunk of replicates of one graph (runs in a worker).
+
+    The graph and its initial values are generated from the graph seed, so every
+    chunk of the same point works on the same graph. With a prediction
+    tolerance, a pilot of `pilot` replicates is compared with the spectral
+    prediction (heuristic_rate for the selection rule and the speeds of the
+    agents) first and the remaining replicates are only simulated if they
+    disagree."""
+    point, graph_seed, rep_seed, reps, config, metrics, pilot, tol = task
+    # same graph and initial values in every chunk
+    seed_all(graph_seed)
+    G = make_graph(point)
+    V0 = np.random.normal(0, 1, G.number_of_nodes())
+    # replicates: permutations of the initial values
+    config_param = dict(config)
+    config_param["graph"] = G
+    config_param["features"] = [AgentFeatures(v, 1, 1) for v in V0]
+    config_param["seed"] = rep_seed
+    stats_net = graph_metrics(G)[0] if metrics else {}
+    if tol is None:
+        err, slopes = run_replicates(config_param, reps=reps)
+        return slopes, stats_net
+    # pilot simulation against the spectral prediction
+    selection = config_param.get("selection", random_selection)
+    speeds = [f.speed for f in config_param["features"]]
+    predicted = heuristic_rate(G, selection, speeds)
+    l2, bound = predicted_rate(G, selection, speeds)
+    pilot = min(pilot, reps)
+    err, slopes = run_replicates(config_param, reps=pilot)
+    stats_net = dict(stats_net, predicted=predicted, lambda_2=l2, boyd_bound=bound, pilot_slope=np.mean(slopes))
+    if np.abs(np.mean(slopes) - predicted) <= tol*np.mean(slopes):
+        stats_net["source"] = "spectral"
+        return np.full(reps, predicted), stats_net
+    stats_net["source"] = "simulation"
+    if reps == pilot:
+        return slopes, stats_net
+    config_param["seed"] = rep_seed.spawn(1)[0]
+    err, rest = run_replicates(config_param, reps=reps - pilot)
+    return np.concatenate([slopes, rest]), stats_net
+
+def sweep(grid, reps=100, rep_chunk=None, seed=0, max_workers=None, config=default_config, metrics=True, store=None,
+          predict_tol=None, pilot=10):
+    """Run a parameter sweep over a process pool, yielding one row per graph.
+
+    Every (graph, chunk of replicates) pair is a separate task. Seeds are derived
+    from `seed` and the position of the task in the grid, so results do not depend
+    on the number of workers or the completion order. Rows are yielded as soon as
+    all the replicates of a graph are done, with the mean contraction rate and,
+    if requested, the graph metrics. If a ResultsStore is given, every row is
+    appended to it as soon as it is done and the points already in the store
+    are skipped. With predict_tol set, the heuristic spectral prediction is used (and
+    recorded with source "spectral") for every graph where a pilot of `pilot`
+    replicates agrees with it within that relative tolerance; the other graphs
+    are fully simulated in a single task."""
+    rep_chunk = reps if predict_tol is not None else rep_chunk or reps
+    chunks = [min(rep_chunk, reps - r) for r in range(0, reps, rep_chunk)]
+    point_seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    done = store.done_keys() if store is not None else set()
+    slopes = {i: {} for i in range(len(grid))}
+    stats = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for i, point in enumerate(grid):
+            if store is not None and store.key(dict(point, seed=seed)) in done:
+                continue
+            graph_seed, *rep_seeds = point_seeds[i].spawn(len(chunks) + 1)
+            for j, n in enumerate(chunks):
+                task = (point, graph_seed, rep_seeds[j], n, config, metrics and j == 0, pilot, predict_tol)
+                futures[pool.submit(run_task, task)] = (i, j)
+        for future in as_completed(futures):
+            i, j = futures[future]
+            chunk_slopes, stats_net = future.result()
+            slopes[i][j] = chunk_slopes
+            if stats_net:
+                stats[i] = stats_net
+            # all chunks of the graph are done
+            if len(slopes[i]) == len(chunks):
+                graph_slopes = slopes.pop(i)
+                row = dict(grid[i])
+                row["seed"] = seed
+                row["slope"] = np.mean(np.concatenate([graph_slopes[j] for j in range(len(chunks))]))
+                row.update(stats.pop(i, {}))
+                if store is not None:
+                    store.append(row)
+                yield row